@@ -1,15 +1,26 @@
 import os
+from datetime import datetime
 
-from flask import Flask, render_template, request, flash, redirect, session, g, url_for
+from flask import (
+    Flask, render_template, request, flash, redirect, session, g, url_for,
+    abort, get_flashed_messages, stream_with_context,
+)
 from flask_debugtoolbar import DebugToolbarExtension
+from flask_wtf.csrf import generate_csrf
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import delete, or_, tuple_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only, selectinload
 
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm, CsrfOnlyForm
-from models import db, connect_db, User, Message
+from models import db, connect_db, User, Message, Follows, Like
 import pdb
 from functools import wraps
 
 CURR_USER_KEY = "curr_user"
+USERS_PER_PAGE = 50
+MESSAGES_PER_PAGE = 100
 
 database_url = os.environ.get('DATABASE_URL', 'postgresql:///warbler')
 
@@ -21,13 +32,51 @@ app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
+# only the debug toolbar reads recorded queries
+app.config['SQLALCHEMY_RECORD_QUERIES'] = app.debug
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 25,
+    'max_overflow': 10,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+    'pool_use_lifo': True,
+}
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
-toolbar = DebugToolbarExtension(app)
+# bcrypt work factor; tests lower it, since each extra round doubles the cost
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+
+if os.environ.get('FLASK_ENV') == 'testing':
+    app.config.from_object('config.TestingConfig')
+
+if app.debug:
+    toolbar = DebugToolbarExtension(app)
+
+# keep compiled templates on disk so fresh workers skip recompiling them
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
 
 connect_db(app)
 
 
+class AppGlobals(app.app_ctx_globals_class):
+    """Flask `g` with a CSRF-only form that every route can use.
+
+    The form is built the first time a route or template touches
+    g.csrf_form, so requests that never render or validate it skip both
+    building it and any per-request hook.
+    """
+
+    @property
+    def csrf_form(self):
+        if "_csrf_form" not in self.__dict__:
+            self._csrf_form = CsrfOnlyForm()
+
+        return self._csrf_form
+
+
+app.app_ctx_globals_class = AppGlobals
+
+
 ##############################################################################
 # User signup/login/logout
 
@@ -38,29 +87,34 @@ def login_required(func):
     def check_logged_in(*args, **kwargs): 
         if not g.user:
             flash("Access unauthorized.", "danger")
-            return redirect("/") 
+            return redirect(url_for("homepage"))
         else: 
             return func(*args, **kwargs)
     
     return check_logged_in
 
 
+def ensure_exists_or_404(model, ident):
+    """Abort with a 404 unless a `model` row with id `ident` exists.
+
+    Only the id column is selected, so no row is loaded into the session.
+    """
+
+    if db.session.query(model.id).filter_by(id=ident).scalar() is None:
+        abort(404)
+
+
 @app.before_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = db.session.get(User, session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
-@app.before_request
-def add_csrf_only_form():
-    """Add a CSRF-only form so that every route can use it."""
-    g.csrf_form = CsrfOnlyForm()
-
 
 
 def do_login(user):
@@ -107,7 +161,7 @@ def signup():
 
         do_login(user)
 
-        return redirect("/")
+        return redirect(url_for("homepage"))
 
     else:
         return render_template('users/signup.html', form=form)
@@ -126,7 +180,7 @@ def login():
         if user:
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
-            return redirect("/")
+            return redirect(url_for("homepage"))
 
         flash("Invalid credentials.", 'danger')
 
@@ -152,24 +206,44 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username, and a
+    'page' param to pick the page of results.
     """
 
     search = request.args.get('q')
+    page = request.args.get('page', 1, type=int)
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    # only load the columns the user cards display
+    query = User.query.options(load_only(User.id,
+                                         User.username,
+                                         User.image_url,
+                                         User.header_image_url,
+                                         User.bio))
+
+    if search:
+        query = query.filter(User.username.ilike(f"%{search}%"))
 
-    return render_template('users/index.html', users=users)
+    pagination = (query
+                  .order_by(User.username)
+                  .paginate(page=page, per_page=USERS_PER_PAGE, error_out=False))
+
+    return render_template('users/index.html',
+                           users=pagination.items,
+                           pagination=pagination)
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = (User
+            .query
+            .options(selectinload(User.messages)
+                     .selectinload(Message.liked_users),
+                     selectinload(User.following),
+                     selectinload(User.followers),
+                     selectinload(User.liked_messages))
+            .get_or_404(user_id))
 
     return render_template('users/show.html', user=user)
 
@@ -179,7 +253,13 @@ def users_show(user_id):
 def show_following(user_id):
     """Show list of people this user is following."""
 
-    user = User.query.get_or_404(user_id)
+    user = (User
+            .query
+            .options(selectinload(User.following),
+                     selectinload(User.followers),
+                     selectinload(User.messages),
+                     selectinload(User.liked_messages))
+            .get_or_404(user_id))
     return render_template('users/following.html', user=user)
 
 
@@ -188,7 +268,13 @@ def show_following(user_id):
 def users_followers(user_id):
     """Show list of followers of this user."""
 
-    user = User.query.get_or_404(user_id)
+    user = (User
+            .query
+            .options(selectinload(User.followers),
+                     selectinload(User.following),
+                     selectinload(User.messages),
+                     selectinload(User.liked_messages))
+            .get_or_404(user_id))
     return render_template('users/followers.html', user=user)
 
 
@@ -198,8 +284,13 @@ def add_follow(follow_id):
     """Add a follow for the currently-logged-in user."""
 
     if g.csrf_form.validate_on_submit():
-        followed_user = User.query.get_or_404(follow_id)
-        g.user.following.append(followed_user)
+        ensure_exists_or_404(User, follow_id)
+        db.session.execute(
+            insert(Follows)
+            .values(user_following_id=g.user.id,
+                    user_being_followed_id=follow_id)
+            .on_conflict_do_nothing()
+        )
         db.session.commit()
 
     return redirect(url_for('show_following', user_id=g.user.id))
@@ -211,8 +302,11 @@ def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user."""
 
     if g.csrf_form.validate_on_submit():
-        followed_user = User.query.get(follow_id)
-        g.user.following.remove(followed_user)
+        db.session.execute(
+            delete(Follows)
+            .where(Follows.user_following_id == g.user.id,
+                   Follows.user_being_followed_id == follow_id)
+        )
         db.session.commit()
 
     return redirect(url_for('show_following', user_id=g.user.id))
@@ -255,7 +349,10 @@ def delete_user():
     if g.csrf_form.validate_on_submit():
         do_logout()
 
-        Message.query.filter(Message.user_id == g.user.id).delete()
+        (Message
+         .query
+         .filter(Message.user_id == g.user.id)
+         .delete(synchronize_session=False))
         db.session.delete(g.user)
         db.session.commit()
 
@@ -301,8 +398,13 @@ def messages_destroy(message_id):
     """Delete a message."""
 
     if g.csrf_form.validate_on_submit():
-        msg = Message.query.get_or_404(message_id)
-        db.session.delete(msg)
+        deleted = (Message
+                   .query
+                   .filter_by(id=message_id)
+                   .delete(synchronize_session=False))
+        if not deleted:
+            abort(404)
+
         db.session.commit()
 
     return redirect(url_for("users_show", user_id=g.user.id))
@@ -317,11 +419,15 @@ def like_message(message_id):
     """Like a message for current user."""
 
     if g.csrf_form.validate_on_submit():
-        liked_message = Message.query.get_or_404(message_id)
-        g.user.liked_messages.append(liked_message)
+        ensure_exists_or_404(Message, message_id)
+        db.session.execute(
+            insert(Like)
+            .values(user_id=g.user.id, message_id=message_id)
+            .on_conflict_do_nothing()
+        )
         db.session.commit()
 
-    return redirect("/")
+    return redirect(url_for("homepage"))
 
 
 @app.route('/users/unlike/<int:message_id>', methods=['POST'])
@@ -330,18 +436,31 @@ def unlike_message(message_id):
     """Unlike a message for current user."""
 
     if g.csrf_form.validate_on_submit():
-        liked_message = Message.query.get_or_404(message_id)
-        g.user.liked_messages.remove(liked_message)
+        ensure_exists_or_404(Message, message_id)
+        db.session.execute(
+            delete(Like)
+            .where(Like.user_id == g.user.id,
+                   Like.message_id == message_id)
+        )
         db.session.commit()
 
-    return redirect("/")
+    return redirect(url_for("homepage"))
 
 @app.route('/users/<int:user_id>/likes')
 @login_required
 def users_likes(user_id):
     """Show list of likes of this user."""
 
-    user = User.query.get_or_404(user_id)
+    user = (User
+            .query
+            .options(selectinload(User.liked_messages)
+                     .selectinload(Message.user),
+                     selectinload(User.liked_messages)
+                     .selectinload(Message.liked_users),
+                     selectinload(User.following),
+                     selectinload(User.followers),
+                     selectinload(User.messages))
+            .get_or_404(user_id))
     return render_template('users/likes.html', user=user)
 
 
@@ -349,30 +468,78 @@ def users_likes(user_id):
 ##############################################################################
 # Homepage and error pages
 
+# the anon homepage is identical for every visitor, so it is rendered once
+anon_homepage_html = None
+
+
+def stream_template(template_name, **context):
+    """Render a template as a stream of chunks, sent as they are produced.
+
+    The session cookie goes out before the body is rendered, so anything
+    the template would store in the session (popped flashed messages, a
+    fresh CSRF token) is done up front instead.
+    """
+
+    get_flashed_messages()
+    generate_csrf()
+
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+
+    return stream_with_context(template.generate(context))
+
 
 @app.route('/')
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, or the 100
+      older than the 'before' timestamp and 'before_id' message id in the
+      querystring
     """
 
     if g.user:
-        following_ids = [user.id for user in g.user.following]
-        following_ids.append(g.user.id)
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
+        before = request.args.get('before', type=datetime.fromisoformat)
+        before_id = request.args.get('before_id', type=int)
+
+        followed_ids = (db.session
+                        .query(Follows.user_being_followed_id)
+                        .filter(Follows.user_following_id == g.user.id))
+        query = Message.query.filter(or_(Message.user_id.in_(followed_ids),
+                                         Message.user_id == g.user.id))
+
+        # keyset pagination: seek past the last (timestamp, id) already
+        # shown; the id breaks ties between messages sharing a timestamp
+        if before and before_id is not None:
+            query = query.filter(tuple_(Message.timestamp, Message.id)
+                                 < tuple_(before, before_id))
+
+        messages = (query
+                    .order_by(Message.timestamp.desc(), Message.id.desc())
+                    .limit(MESSAGES_PER_PAGE)
+                    .options(selectinload(Message.user),
+                             selectinload(Message.liked_users))
                     .all())
-                    
-        return render_template('home.html', messages=messages)
 
-    else:
+        return app.response_class(
+            stream_template('home.html',
+                            messages=messages,
+                            has_older=len(messages) == MESSAGES_PER_PAGE))
+
+    # pending flashed messages (e.g. "Access unauthorized") make the page
+    # unique, and in debug mode template edits should show up right away
+    elif app.debug or "_flashes" in session:
         return render_template('home-anon.html')
 
+    else:
+        global anon_homepage_html
+
+        if anon_homepage_html is None:
+            anon_homepage_html = render_template('home-anon.html')
+
+        return anon_homepage_html
+
 
 @app.errorhandler(404)
 def show_404(e): 
@@ -384,16 +551,27 @@ def show_404(e):
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Turn off caching for anything user-specific
+#   (pages for logged-in users, pages embedding a session-bound CSRF token,
+#   or responses that change the session, e.g. consuming flashed messages);
+#   anonymous pages can be cached briefly by browsers and proxies
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
 @app.after_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add caching headers: no-store for user-specific responses, a short
+    public max-age for everything else."""
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
+    # Flask-WTF stores the token on g whenever a form renders one
+    has_csrf_token = app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token') in g
+
+    if g.get('user') or has_csrf_token or session.modified:
+        response.cache_control.no_store = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = 60
+        response.vary.add('Cookie')
+
     return response
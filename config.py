@@ -0,0 +1,21 @@
+"""Configuration overrides loaded by app.py."""
+
+from sqlalchemy.pool import StaticPool
+
+
+class TestingConfig:
+    """Settings for the test suite, loaded when FLASK_ENV is "testing"."""
+
+    TESTING = True
+
+    # Don't have WTForms use CSRF at all, since it's a pain to test
+    WTF_CSRF_ENABLED = False
+
+    # the cheapest bcrypt work factor; tests hash throwaway passwords
+    BCRYPT_LOG_ROUNDS = 4
+
+    # The tests only ever hold one connection at a time, so keep that
+    # single connection open for the whole run instead of a pool. Not
+    # NullPool: that would open (and Postgres fork a backend for) a new
+    # connection for every test class.
+    SQLALCHEMY_ENGINE_OPTIONS = {'poolclass': StaticPool}
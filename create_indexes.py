@@ -0,0 +1,14 @@
+"""Add indexes declared on the models to an existing database.
+
+db.create_all() (and seed.py) only create indexes along with brand-new
+tables, so run this once against databases created before an index was
+added:
+
+    python create_indexes.py
+"""
+
+from app import db
+
+for table in db.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(bind=db.engine, checkfirst=True)
@@ -26,6 +26,12 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key leads with user_being_followed_id, so lookups of who
+    # a user follows need their own index
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id'),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -72,26 +78,33 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message', order_by='Message.timestamp.desc()')
+    messages = db.relationship(
+        'Message',
+        order_by='Message.timestamp.desc()',
+        passive_deletes='all',
+    )
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     liked_messages = db.relationship(
         "Message",
         secondary="likes",
-        backref="liked_users"
+        backref="liked_users",
+        passive_deletes=True,
     )
 
     def __repr__(self):
@@ -176,6 +189,11 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # serves "messages by these users, newest first" (homepage, profiles)
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', user_id, timestamp.desc()),
+    )
+
     def __repr__(self):
         return f"<Message #{self.id}: {self.text} by {self.user_id}>"
     
@@ -199,6 +217,12 @@ class Like(db.Model):
         primary_key=True
     )
 
+    # the primary key leads with user_id, so finding a message's likers
+    # needs its own index
+    __table_args__ = (
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -208,3 +232,4 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    bcrypt.init_app(app)
@@ -2,113 +2,96 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_like_views.py
+#    python -m unittest test_like_views.py
 
 
-import os
-from unittest import TestCase
 from flask import session
+from sqlalchemy import insert
 
-from models import db, Message, User
+from models import db, Like, Message, User
+from testutils import TransactionalTestCase, app, PASSWORD_HASH
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+class LikeViewTestCase(TransactionalTestCase):
+    """Test views for Like."""
 
-# Now we can import app
+    @classmethod
+    def setUpClass(cls):
+        """Create the test client shared by every test."""
 
-from app import app, CURR_USER_KEY
+        super().setUpClass()
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
+        cls.client = app.test_client()
 
-db.create_all()
+    def setUp(self):
+        """Log the test client out, add sample data."""
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
+        super().setUp()
 
-app.config['WTF_CSRF_ENABLED'] = False
+        self.client.cookie_jar.clear()
 
+        self.testuser = User(username="testuser",
+                             email="test@test.com",
+                             password=PASSWORD_HASH)
 
-class LikeViewTestCase(TestCase):
-    """Test views for Like."""
+        self.testuser2 = User(username="testuser2",
+                              email="test2@test.com",
+                              password=PASSWORD_HASH)
 
-    def setUp(self):
-        """Create test client, add sample data."""
+        self.message = Message(text="test message", user=self.testuser)
 
-        Message.query.delete()
-        User.query.delete()
+        db.session.add_all([self.testuser, self.testuser2, self.message])
+        db.session.flush()
 
-        self.client = app.test_client()
+        # keep the ids, since the commit expires the objects and requests
+        # detach them
+        self.testuser_id = self.testuser.id
+        self.testuser2_id = self.testuser2.id
+        self.message_id = self.message.id
 
-        self.testuser = User.signup(username="testuser",
-                                    email="test@test.com",
-                                    password="password",
-                                    image_url=None)
-
-        self.testuser2 = User.signup(username="testuser2",
-                            email="test2@test.com",
-                            password="password",
-                            image_url=None)
         db.session.commit()
 
 
-        self.message = Message(text="test message", user_id=self.testuser.id)
-        db.session.add(self.message)
-        db.session.commit()
-
-        self.testuser2 = User.query.filter_by(username="testuser2").first()
-        self.message = Message.query.filter_by(user_id=self.testuser.id).first()
-
-
     def tearDown(self):
         """Clean up any fouled transaction."""
 
-        db.session.rollback()
+        super().tearDown()
 
 
     def test_logged_in_user_view_others_likes(self):
         """Can a logged in user view others' liked messages page"""
 
         with self.client as c:  
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+            self.login(c, self.testuser_id)
             
-            response = c.get(f"/users/{self.testuser2.id}/likes")
-
-            html = response.get_data(as_text=True)
+            with self.assertMaxQueries(7):
+                response = c.get(f"/users/{self.testuser2_id}/likes")
 
             self.assertEqual(response.status_code, 200)
-            self.assertIn(f"@{self.testuser2.username}", html)
+            self.assertIn(b"@testuser2", response.data)
 
 
     def test_logged_out_view_others_likes(self):
         """Can not access others' liked messages page when logged out"""   
 
         with self.client as c:
-            response = c.get(f"/users/{self.testuser2.id}/likes",
+            response = c.get(f"/users/{self.testuser2_id}/likes",
                             follow_redirects=True)
 
-            html = response.get_data(as_text=True)
-
             self.assertEqual(response.status_code, 200)
-            self.assertIn("Access unauthorized", html)
+            self.assertIn(b"Access unauthorized", response.data)
     
 
     def test_like_message(self):
         """Can like another's message?"""
 
         with self.client as c:  
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser2.id
+            self.login(c, self.testuser2_id)
 
-            response = c.post(f"/users/like/{self.message.id}", follow_redirects=True)
+            response = c.post(f"/users/like/{self.message_id}", follow_redirects=True)
 
-            user2 = User.query.get(self.testuser2.id)
-            message = Message.query.get(self.message.id)
+            user2 = User.query.get(self.testuser2_id)
+            message = Message.query.get(self.message_id)
             
             self.assertEqual(response.status_code, 200)
             self.assertIn(message, user2.liked_messages)
@@ -117,49 +100,71 @@ class LikeViewTestCase(TestCase):
     def test_unlike_message(self):
         """Can unlike another's message?"""
 
-        with self.client as c:  
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser2.id
+        # user2 likes a message
+        db.session.execute(
+            insert(Like)
+            .values(user_id=self.testuser2_id, message_id=self.message_id)
+        )
+        db.session.commit()
 
-            # user2 likes a message
-            c.post(f"/users/like/{self.message.id}", follow_redirects=True)
+        with self.client as c:  
+            self.login(c, self.testuser2_id)
 
             # user2 unlike message
-            response = c.post(f"/users/unlike/{self.message.id}", follow_redirects=True)
+            response = c.post(f"/users/unlike/{self.message_id}", follow_redirects=True)
 
-            user2 = User.query.get(self.testuser2.id)
-            message = Message.query.get(self.message.id)
+            user2 = User.query.get(self.testuser2_id)
+            message = Message.query.get(self.message_id)
             
             self.assertEqual(response.status_code, 200)
             self.assertNotIn(message, user2.liked_messages)
             self.assertEqual(len(user2.liked_messages), 0)
 
+    def test_like_invalid_message(self):
+        """Does liking a message that does not exist 404?"""
+
+        with self.client as c:
+            self.login(c, self.testuser2_id)
+
+            response = c.post("/users/like/0")
+
+            self.assertEqual(response.status_code, 404)
+
+    def test_unlike_invalid_message(self):
+        """Does unliking a message that does not exist 404?"""
+
+        with self.client as c:
+            self.login(c, self.testuser2_id)
+
+            response = c.post("/users/unlike/0")
+
+            self.assertEqual(response.status_code, 404)
+
     def test_like_message_not_logged_in(self):
         """Can not like another's message when not logged in"""
 
         with self.client as c:  
-            response = c.post(f"/users/like/{self.message.id}", follow_redirects=True)
-            html = response.get_data(as_text=True)
+            response = c.post(f"/users/like/{self.message_id}", follow_redirects=True)
 
-            user2 = User.query.get(self.testuser2.id)
+            user2 = User.query.get(self.testuser2_id)
             
             self.assertEqual(response.status_code, 200)
-            self.assertIn("Access unauthorized", html)
             self.assertEqual(len(user2.liked_messages), 0)
+            self.assertIn(b"Access unauthorized", response.data)
     
     def test_unlike_message_not_logged_in(self):
         """Can not unlike another's message when not logged in"""
 
         with self.client as c:  
-            message = Message.query.get(self.message.id)
-            self.testuser2.liked_messages.append(message)
+            user2 = User.query.get(self.testuser2_id)
+            message = Message.query.get(self.message_id)
+            user2.liked_messages.append(message)
             db.session.commit()
 
-            response = c.post(f"/users/like/{self.message.id}", follow_redirects=True)
-            html = response.get_data(as_text=True)
+            response = c.post(f"/users/like/{self.message_id}", follow_redirects=True)
 
-            user2 = User.query.filter_by(username="testuser2").first()
+            user2 = User.query.get(self.testuser2_id)
     
             self.assertEqual(response.status_code, 200)
-            self.assertIn("Access unauthorized", html)
-            self.assertEqual(len(user2.liked_messages), 1)
\ No newline at end of file
+            self.assertEqual(len(user2.liked_messages), 1)
+            self.assertIn(b"Access unauthorized", response.data)
\ No newline at end of file
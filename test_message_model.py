@@ -2,47 +2,27 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_message_model.py
+#    python -m unittest test_message_model.py
 
 
-import os
-from unittest import TestCase
-
 from sqlalchemy.exc import IntegrityError
 
 from models import db, User, Message
+from testutils import TransactionalTestCase, PASSWORD_HASH
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-# Now we can import app
-
-from app import app
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
-
-
-class MessageModelTestCase(TestCase):
+class MessageModelTestCase(TransactionalTestCase):
     """Test views for messages."""
 
     def setUp(self):
-        """Create test client, add sample data."""
+        """Add sample data."""
 
-        Message.query.delete()
-        User.query.delete()
+        super().setUp()
 
-        user = User.signup(
+        user = User(
             email="test@test.com",
             username="testuser",
-            password="HASHED_PASSWORD",
+            password=PASSWORD_HASH,
             image_url=""
         )
 
@@ -59,13 +39,11 @@ class MessageModelTestCase(TestCase):
         db.session.commit()
         self.message = message
 
-        self.client = app.test_client()
-
 
     def tearDown(self):
         """Clean up any fouled transaction."""
 
-        db.session.rollback()
+        super().tearDown()
 
 
     def test_message_model(self):
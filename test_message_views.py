@@ -2,72 +2,60 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_message_views.py
+#    python -m unittest test_message_views.py
 
 
-import os
-from unittest import TestCase
+import re
+from datetime import datetime
+from html import unescape
+from unittest.mock import patch
 
 from models import db, Message, User
+from testutils import TransactionalTestCase, app, PASSWORD_HASH
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-# Now we can import app
-
-from app import app, CURR_USER_KEY
-
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
-
-db.create_all()
-
-# Don't have WTForms use CSRF at all, since it's a pain to test
+class MessageViewTestCase(TransactionalTestCase):
+    """Test views for messages."""
 
-app.config['WTF_CSRF_ENABLED'] = False
+    @classmethod
+    def setUpClass(cls):
+        """Create the test client shared by every test."""
 
+        super().setUpClass()
 
-class MessageViewTestCase(TestCase):
-    """Test views for messages."""
+        cls.client = app.test_client()
 
     def setUp(self):
-        """Create test client, add sample data."""
+        """Log the test client out, add sample data."""
 
-        Message.query.delete()
-        User.query.delete()
+        super().setUp()
 
-        self.client = app.test_client()
+        self.client.cookie_jar.clear()
 
-        self.testuser = User.signup(username="testuser",
-                                    email="test@test.com",
-                                    password="testuser",
-                                    image_url=None)
+        self.testuser = User(username="testuser",
+                             email="test@test.com",
+                             password=PASSWORD_HASH)
 
+        db.session.add(self.testuser)
         db.session.commit()
 
 
     def tearDown(self):
         """Clean up any fouled transaction."""
 
-        db.session.rollback()
+        super().tearDown()
 
 
     def test_add_message(self):
         """Can user add a message?"""
 
         # Since we need to change the session to mimic logging in,
-        # we need to use the changing-session trick:
+        # we give the client a logged in session cookie:
 
         with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+            self.login(c, self.testuser.id)
 
-            # Now, that session setting is saved, so we can have
+            # Now, that session cookie is set, so we can have
             # the rest of ours test
 
             resp = c.post("/messages/new", data={"text": "Hello"})
@@ -82,20 +70,30 @@ class MessageViewTestCase(TestCase):
     def test_delete_message(self):
         """Can user delete their own message?"""
 
-        with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+        msg = Message(text="Hello", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
 
-            # adds message
-            c.post("/messages/new", data={"text": "Hello"})
-            msg = Message.query.one()
-            self.assertEqual("Hello", msg.text)
+        with self.client as c:
+            self.login(c, self.testuser.id)
 
             # deletes message
-            delete_resp = c.post(f"/messages/{msg.id}/delete")
+            delete_resp = c.post(f"/messages/{msg_id}/delete")
 
             self.assertEqual(delete_resp.status_code, 302)
-            self.assertEqual(Message.query.count(), 0)
+            self.assertIsNone(db.session.get(Message, msg_id))
+
+
+    def test_delete_invalid_message(self):
+        """Does deleting a message that does not exist 404?"""
+
+        with self.client as c:
+            self.login(c, self.testuser.id)
+
+            resp = c.post("/messages/0/delete")
+
+            self.assertEqual(resp.status_code, 404)
 
 
     def test_find_invalid_message(self):
@@ -111,21 +109,92 @@ class MessageViewTestCase(TestCase):
     def test_show_message(self):
         """Can see message details?"""
 
-        with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+        msg = Message(text="Hello", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
 
-            # adds message
-            c.post("/messages/new", data={"text": "Hello"})
-            msg = Message.query.one()
+        with self.client as c:
+            self.login(c, self.testuser.id)
 
             # gets message
-            resp = c.get(f"/messages/{msg.id}")
-            html = resp.get_data(as_text=True)
+            resp = c.get(f"/messages/{msg_id}")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(b"Test Message - For Testing", resp.data)
+            self.assertIn(b"Hello", resp.data)
+
+
+    def test_homepage_before(self):
+        """Does the homepage only show messages older than the cursor?"""
+
+        new = Message(text="new warble", user_id=self.testuser.id,
+                      timestamp=datetime(2021, 1, 1))
+        db.session.add_all([
+            Message(text="old warble", user_id=self.testuser.id,
+                    timestamp=datetime(2020, 1, 1)),
+            new,
+        ])
+        db.session.commit()
+        new_id = new.id
+
+        with self.client as c:
+            self.login(c, self.testuser.id)
+
+            resp = c.get(f"/?before=2021-01-01T00:00:00&before_id={new_id}")
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Test Message - For Testing", html)
-            self.assertIn(msg.text, str(resp.data))
+            self.assertIn(b"old warble", resp.data)
+            self.assertNotIn(b"new warble", resp.data)
+
+
+    def test_homepage_pages_through_same_timestamp(self):
+        """Does paging keep messages that share the boundary timestamp?"""
+
+        same_time = datetime(2021, 1, 1)
+        db.session.add_all([
+            Message(text="first twin", user_id=self.testuser.id,
+                    timestamp=same_time),
+            Message(text="second twin", user_id=self.testuser.id,
+                    timestamp=same_time),
+        ])
+        db.session.commit()
+
+        with self.client as c, patch("app.MESSAGES_PER_PAGE", 1):
+            self.login(c, self.testuser.id)
+
+            first_page = c.get("/").get_data(as_text=True)
+            older_link = re.search(r'href="(/\?before=[^"]+)"', first_page)
+            second_page = c.get(unescape(older_link.group(1)))
+
+            self.assertIn("second twin", first_page)
+            self.assertNotIn("first twin", first_page)
+            self.assertEqual(second_page.status_code, 200)
+            self.assertIn(b"first twin", second_page.data)
+            self.assertNotIn(b"second twin", second_page.data)
+
+
+    def test_homepage_query_count(self):
+        """Does the homepage query count stay flat as messages grow?"""
+
+        others = [User(username=f"other{i}", email=f"other{i}@test.com",
+                       password="password") for i in range(5)]
+        messages = [Message(text=f"warble {i}", user=others[i % 5])
+                    for i in range(20)]
+        db.session.add_all(others + messages)
+        db.session.flush()
+        self.testuser.following.extend(others)
+        self.testuser.liked_messages.extend(messages[::2])
+        db.session.commit()
+        testuser_id = self.testuser.id
+
+        with self.client as c:
+            self.login(c, testuser_id)
+
+            with self.assertMaxQueries(7):
+                body = c.get("/").data
+
+            self.assertIn(b"warble 19", body)
 
 
     def test_add_message_not_logged_in(self):
@@ -135,10 +204,9 @@ class MessageViewTestCase(TestCase):
             # we do not set the session so we are not "logged in"
             # we should be redirected to root
             resp = c.post("/messages/new", data={"text": "Hello"}, follow_redirects=True)
-            html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Access unauthorized", html)
+            self.assertIn(b"Access unauthorized", resp.data)
     
 
     def test_delete_message_not_logged_in(self):
@@ -148,9 +216,8 @@ class MessageViewTestCase(TestCase):
             # we do not set the session so we are not "logged in"
             # we should be redirected to root
             resp = c.post("/messages/1/delete", follow_redirects=True)
-            html = resp.get_data(as_text=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Access unauthorized", html)
+            self.assertIn(b"Access unauthorized", resp.data)
 
     
@@ -5,66 +5,56 @@
 #    python -m unittest test_user_model.py
 
 
-import os
-from unittest import TestCase
-
+from sqlalchemy import insert
 from sqlalchemy.exc import IntegrityError
 
-from models import db, User, Message, Follows
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
-
-# Now we can import app
+from models import db, bcrypt, User
+from testutils import TransactionalTestCase
 
-from app import app
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
+class UserModelTestCase(TransactionalTestCase):
+    """Test views for messages."""
 
-db.create_all()
+    @classmethod
+    def setUpClass(cls):
+        """Add the users every test starts from."""
+
+        super().setUpClass()
+
+        password = bcrypt.generate_password_hash(
+            "HASHED_PASSWORD").decode('UTF-8')
+
+        # one multi-row INSERT instead of a flush per user
+        ids = dict(db.session.execute(
+            insert(User)
+            .values([
+                dict(email="test@test.com", username="testuser",
+                     password=password, image_url=""),
+                dict(email="test2@test.com", username="testuser2",
+                     password=password, image_url=""),
+            ])
+            .returning(User.username, User.id)
+        ).all())
+        db.session.commit()
 
+        cls.user_id = ids["testuser"]
+        cls.user2_id = ids["testuser2"]
 
-class UserModelTestCase(TestCase):
-    """Test views for messages."""
+        db.session.remove()
 
     def setUp(self):
-        """Create test client, add sample data."""
+        """Load sample data."""
 
-        Follows.query.delete()
-        Message.query.delete()
-        User.query.delete()
+        super().setUp()
 
-        user = User.signup(
-            email="test@test.com",
-            username="testuser",
-            password="HASHED_PASSWORD",
-            image_url=""
-        )
-
-        user2 = User.signup(
-            email="test2@test.com",
-            username="testuser2",
-            password="HASHED_PASSWORD",
-            image_url=""
-        )
-        db.session.add_all([user, user2])
-        db.session.commit()
-        self.user = user
-        self.user2 = user2
-
-        self.client = app.test_client()
+        self.user = db.session.get(User, self.user_id)
+        self.user2 = db.session.get(User, self.user2_id)
 
 
     def tearDown(self):
         """Clean up any fouled transaction."""
 
-        db.session.rollback()
+        super().tearDown()
 
 
     def test_user_model(self):
@@ -134,7 +124,6 @@ class UserModelTestCase(TestCase):
             image_url=""
         )
 
-        db.session.add(u)
         db.session.commit()
 
         # user = User.query.filter()
@@ -150,31 +139,31 @@ class UserModelTestCase(TestCase):
         """Does User.signup fail to create a new user if any of the validations
            (e.g. uniqueness, non-nullable fields) fail?"""
 
-        u = User.signup(
-            username="testuser", #this is a duplicate username
-            password="HASHED_PASSWORD",
-            email="test@email.com",
-            image_url=""
-        )
-
-        db.session.add(u)
-
+        # fail inside a SAVEPOINT so the test's transaction stays usable
         with self.assertRaises(IntegrityError):
-            db.session.commit()
+            with db.session.begin_nested():
+                User.signup(
+                    username="testuser", #this is a duplicate username
+                    password="HASHED_PASSWORD",
+                    email="test@email.com",
+                    image_url=""
+                )
+
+        self.assertEqual(User.authenticate("testuser", "HASHED_PASSWORD"),
+                         self.user)
 
 ########################################### AUTHENTICATE TESTS ####################################################
 
     def test_user_authenticate_success(self):
         """Does User.authenticate return user when given valid username and password?"""
 
-        existing_user = User.signup(
+        User.signup(
             username="tester",
             password="HASHED_PASSWORD",
             email="tester@test.com",
             image_url=""
         )
 
-        db.session.add(existing_user)
         db.session.commit()
 
         user = User.authenticate("tester", "HASHED_PASSWORD")
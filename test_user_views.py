@@ -2,70 +2,77 @@
 
 # run these tests like:
 #
-#    FLASK_ENV=production python -m unittest test_user_views.py
+#    python -m unittest test_user_views.py
 
 # Missing tests: login w/ wrong pw, login w/ wrong username, edit profile w/
-#   wrong pw, search for user with search term, homepage display when logged
-#   in with following/followers
+#   wrong pw, homepage display when logged in with following/followers
 
-import os
-from unittest import TestCase
+import re
+from unittest.mock import patch
 from flask import session
+from sqlalchemy import insert
 
 from models import db, Message, User
+from testutils import (
+    TransactionalTestCase, app, CURR_USER_KEY, PASSWORD_HASH,
+)
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+import app as app_module
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
-# Now we can import app
+class UserViewTestCase(TransactionalTestCase):
+    """Test views for Users."""
 
-from app import app, CURR_USER_KEY
+    @classmethod
+    def setUpClass(cls):
+        """Create the shared test client and the users every test
+        starts from."""
 
-# Create our tables (we do this here, so we only create the tables
-# once for all tests --- in each test, we'll delete the data
-# and create fresh new clean test data
+        super().setUpClass()
 
-db.create_all()
+        cls.client = app.test_client()
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
+        # one multi-row INSERT instead of a flush per user
+        ids = dict(db.session.execute(
+            insert(User)
+            .values([
+                dict(username="testuser", email="test@test.com",
+                     password=PASSWORD_HASH),
+                dict(username="testuser2", email="test2@test.com",
+                     password=PASSWORD_HASH),
+            ])
+            .returning(User.username, User.id)
+        ).all())
 
-app.config['WTF_CSRF_ENABLED'] = False
+        db.session.commit()
 
+        cls.testuser_id = ids["testuser"]
+        cls.testuser2_id = ids["testuser2"]
 
-class UserViewTestCase(TestCase):
-    """Test views for Users."""
+        # "@testuser" is a prefix of "@testuser2", so match whole handles
+        cls.testuser_handle = re.compile(rb"@testuser\b")
+        cls.testuser2_handle = re.compile(rb"@testuser2\b")
 
-    def setUp(self):
-        """Create test client, add sample data."""
+        db.session.remove()
 
-        Message.query.delete()
-        User.query.delete()
+    def setUp(self):
+        """Log the test client out, load sample data."""
 
-        self.client = app.test_client()
+        super().setUp()
 
-        self.testuser = User.signup(username="testuser",
-                                    email="test@test.com",
-                                    password="password",
-                                    image_url=None)
+        # forget the cached anon homepage so each test renders its own
+        app_module.anon_homepage_html = None
 
-        self.testuser2 = User.signup(username="testuser2",
-                            email="test2@test.com",
-                            password="password",
-                            image_url=None)
+        self.client.cookie_jar.clear()
 
-        db.session.commit()
-
-        self.testuser2 = User.query.filter_by(username="testuser2").first()
+        self.testuser = db.session.get(User, self.testuser_id)
+        self.testuser2 = db.session.get(User, self.testuser2_id)
 
 
     def tearDown(self):
         """Clean up any fouled transaction."""
 
-        db.session.rollback()
+        super().tearDown()
 
 ########################################### LOGIN/LOGOUT TESTS ####################################################
     
@@ -76,13 +83,12 @@ class UserViewTestCase(TestCase):
             response = c.post(
                             "/login",
                             data={"username": "testuser", "password": "password"},
-                            follow_redirects=True
                             )
 
-            html = response.get_data(as_text=True)
-
-            self.assertEqual(response.status_code, 200)
-            self.assertIn("User Logged In", html)
+            # check the redirect rather than following it to the homepage
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.location, "http://localhost/")
+            self.assertIn(("success", "Hello, testuser!"), session["_flashes"])
             self.assertEqual(session[CURR_USER_KEY], self.testuser.id)
 
 
@@ -91,74 +97,67 @@ class UserViewTestCase(TestCase):
         """Can user logout successfully?"""
 
         with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+            self.login(c, self.testuser.id)
             
-            response = c.post("/logout", follow_redirects=True)
-            html = response.get_data(as_text=True)
+            response = c.post("/logout")
 
-            self.assertEqual(response.status_code, 200)
-            self.assertIn("Successfully logged out", html)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.location, "http://localhost/login")
+            self.assertIn(("message", "Successfully logged out"),
+                          session["_flashes"])
 
             with self.assertRaises(KeyError): 
                 session[CURR_USER_KEY]
 
 ########################################### VIEW FOLLOWING/FOLLOWER TESTS ####################################################
     
-    def test_logged_in_user_view_others_followers(self):
-        """Can a logged in user view others' followers page"""
+    def test_logged_in_user_view_others_follow_pages(self):
+        """Can a logged in user view others' followers and following pages"""
 
         with self.client as c:  
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
-            
-            response = c.get(f"/users/{self.testuser2.id}/followers")
+            self.login(c, self.testuser.id)
 
-            html = response.get_data(as_text=True)
+            for page in ["followers", "following"]:
+                with self.subTest(page=page):
+                    response = c.get(f"/users/{self.testuser2.id}/{page}")
 
-            self.assertEqual(response.status_code, 200)
-            self.assertIn(f"@{self.testuser2.username}", html)
-
-
-    def test_logged_in_user_view_others_following(self):
-        """Can a logged in user view others' following page"""
-
-        with self.client as c:  
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
-            
-            response = c.get(f"/users/{self.testuser2.id}/following")
-
-            html = response.get_data(as_text=True)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertRegex(response.data, self.testuser2_handle)
 
-            self.assertEqual(response.status_code, 200)
-            self.assertIn(f"@{self.testuser2.username}", html)  
 
+    def test_follow_pages_query_count(self):
+        """Does the follow pages' query count stay flat as follows grow?"""
 
-    def test_logged_out_view_others_followers(self):
-        """Can not access others' followers page when logged out"""   
+        others = [User(username=f"other{i}", email=f"other{i}@test.com",
+                       password="password") for i in range(5)]
+        db.session.add_all(others)
+        self.testuser.following.extend(others[:3])
+        self.testuser2.following.extend(others)
+        self.testuser2.followers.extend(others)
+        db.session.commit()
 
         with self.client as c:
-            response = c.get(f"/users/{self.testuser2.id}/followers",
-                            follow_redirects=True)
+            self.login(c, self.testuser_id)
 
-            html = response.get_data(as_text=True)
+            for page in ["followers", "following"]:
+                with self.assertMaxQueries(7):
+                    response = c.get(f"/users/{self.testuser2_id}/{page}")
 
-            self.assertEqual(response.status_code, 200)
-            self.assertIn("Access unauthorized", html)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b"@other4", response.data)
 
-    
-    def test_logged_out_view_others_following(self):
-        """Can not access others' following page when logged out"""   
+
+    def test_logged_out_view_others_follow_pages(self):
+        """Can not access others' followers and following pages when logged out"""   
 
         with self.client as c:
-            response = c.get(f"/users/{self.testuser2.id}/following",
-                            follow_redirects=True)
+            for page in ["followers", "following"]:
+                with self.subTest(page=page):
+                    response = c.get(f"/users/{self.testuser2.id}/{page}",
+                                    follow_redirects=True)
 
-            html = response.get_data(as_text=True)
-
-            self.assertEqual(response.status_code, 200)
-            self.assertIn("Access unauthorized", html)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertIn(b"Access unauthorized", response.data)
 
 ########################################### USER TESTS ####################################################
 
@@ -176,10 +175,9 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             response = c.get(f"/users/{self.testuser.id}")
-            html = response.get_data(as_text=True)
 
             self.assertEqual(response.status_code, 200)
-            self.assertIn(f"@{self.testuser.username}", html)
+            self.assertRegex(response.data, self.testuser_handle)
     
 ########################################### EDIT PROFILE TESTS ####################################################
 
@@ -187,22 +185,19 @@ class UserViewTestCase(TestCase):
         """Can display edit profile page when logged in?"""
 
         with self.client as c: 
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+            self.login(c, self.testuser.id)
 
             response = c.get("/users/profile")
-            html = response.get_data(as_text=True)
 
             self.assertEqual(response.status_code, 200)
-            self.assertIn("Test Edit User Profile", html)
+            self.assertIn(b"Test Edit User Profile", response.data)
 
     
     def test_post_edit_own_profile(self): 
         """Can post to edit profile page when logged in?"""
 
         with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+            self.login(c, self.testuser.id)
 
             response = c.post("/users/profile",
                               data={
@@ -211,78 +206,126 @@ class UserViewTestCase(TestCase):
                                 },
                               follow_redirects=True)
 
-            html = response.get_data(as_text=True)
-
             self.assertEqual(response.status_code, 200)
-            self.assertIn("updated bio", html)
+            self.assertIn(b"updated bio", response.data)
 
     def test_show_edit_profile_not_logged_in(self):
         """Can not see edit profile page when not logged in"""
 
         with self.client as c:
             response = c.get("/users/profile", follow_redirects=True)
-            html = response.get_data(as_text=True)
 
             self.assertEqual(response.status_code, 200)
-            self.assertIn("Access unauthorized", html)
+            self.assertIn(b"Access unauthorized", response.data)
 
 ########################################### FOLLOW/UNFOLLOW TESTS ####################################################
 
-    def test_follow_user(self):
-        """Can user follow another user?"""
+    def test_follow_then_unfollow_user(self):
+        """Can user follow and then unfollow another user?"""
 
         with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+            self.login(c, self.testuser_id)
 
-            response = c.post(f"/users/follow/{self.testuser2.id}", follow_redirects=True)
-            html = response.get_data(as_text=True)
+            # user is following user2
+            follow_response = c.post(f"/users/follow/{self.testuser2_id}", follow_redirects=True)
 
-            user = User.query.get(sess[CURR_USER_KEY])
+            user = User.query.get(self.testuser_id)
 
-            self.assertEqual(response.status_code, 200)
-            self.assertIn(f"@{self.testuser2.username}", html)
+            self.assertEqual(follow_response.status_code, 200)
             self.assertEqual(len(user.following), 1)
-    
-    def test_unfollow_user(self):
-        """Can user unfollow another user?"""
-
-        with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
-
-            # user is following user2
-            c.post(f"/users/follow/{self.testuser2.id}", follow_redirects=True)
+            self.assertRegex(follow_response.data, self.testuser2_handle)
 
             # user is unfollowing user2
-            unfollow_response = c.post(f"/users/stop-following/{self.testuser2.id}", follow_redirects=True)
-            html = unfollow_response.get_data(as_text=True)
+            unfollow_response = c.post(f"/users/stop-following/{self.testuser2_id}", follow_redirects=True)
 
-            user = User.query.get(sess[CURR_USER_KEY])
+            user = User.query.get(self.testuser_id)
 
             self.assertEqual(unfollow_response.status_code, 200)
-            self.assertNotIn(f"@{self.testuser2.username}", html)
             self.assertEqual(len(user.following), 0)
+            self.assertNotIn(b"@testuser2", unfollow_response.data)
+
+    def test_follow_invalid_user(self):
+        """Does following a user that does not exist 404?"""
+
+        with self.client as c:
+            self.login(c, self.testuser.id)
+
+            response = c.post("/users/follow/0")
+
+            self.assertEqual(response.status_code, 404)
+
+    def test_follow_actions_not_logged_in_fail(self):
+        """Can not user follow or unfollow another user when not logged in"""
+
+        with self.client as c:
+            for action in ["follow", "stop-following"]:
+                with self.subTest(action=action):
+                    response = c.post(f"/users/{action}/{self.testuser2.id}",
+                                      follow_redirects=True)
+
+                    self.assertEqual(response.status_code, 200)
+                    self.assertIn(b"Access unauthorized", response.data)
+
+########################################### HOMEPAGE TESTS ####################################################
+
+    def test_anon_homepage(self):
+        """Is the anon homepage rendered once and then served from cache?"""
+
+        with self.client as c:
+            first = c.get("/")
+
+            self.assertIsNotNone(app_module.anon_homepage_html)
+
+            with patch("app.render_template") as render_template:
+                second = c.get("/")
+
+            render_template.assert_not_called()
+            self.assertEqual(second.status_code, 200)
+            self.assertIn(b"User Not Logged In", second.data)
+            self.assertEqual(first.data, second.data)
+            self.assertTrue(second.cache_control.public)
+
+
+    def test_login_form_not_cached(self):
+        """Is a page with a CSRF token never cacheable, even on repeat visits?"""
 
-    def test_follow_user_not_logged_in_fail(self):
-        """Can not user follow another user when not logged in"""
+        app.config['WTF_CSRF_ENABLED'] = True
+        self.addCleanup(app.config.__setitem__, 'WTF_CSRF_ENABLED', False)
 
         with self.client as c:
-            response = c.post(f"/users/follow/{self.testuser2.id}", follow_redirects=True)
-            html = response.get_data(as_text=True)
+            c.get("/login")
+            response = c.get("/login")
 
             self.assertEqual(response.status_code, 200)
-            self.assertIn("Access unauthorized", html)
-            
-    def test_unfollow_user_not_logged_in_fail(self):
-        """Can not user unfollow another user when not logged in"""
+            self.assertIn(b"csrf_token", response.data)
+            self.assertTrue(response.cache_control.no_store)
+            self.assertFalse(response.cache_control.public)
+
+
+    def test_logged_in_homepage_streams_flashes_once(self):
+        """Is the logged in homepage streamed, showing a flash only once?"""
+
+        with self.client as c:
+            c.post("/login", data={"username": "testuser", "password": "password"})
+
+            first = c.get("/")
+            self.assertTrue(first.is_streamed)
+            self.assertIn(b"Hello, testuser!", first.data)
+
+            second = c.get("/")
+            self.assertNotIn(b"Hello, testuser!", second.data)
+
+
+    def test_logged_in_homepage_not_cached(self):
+        """Is the logged in homepage marked as not cacheable?"""
 
         with self.client as c:
-            response = c.post(f"/users/stop-following/{self.testuser2.id}", follow_redirects=True)
-            html = response.get_data(as_text=True)
+            self.login(c, self.testuser.id)
+
+            response = c.get("/")
 
             self.assertEqual(response.status_code, 200)
-            self.assertIn("Access unauthorized", html)
+            self.assertTrue(response.cache_control.no_store)
 
 ########################################### SEARCH TESTS ####################################################
 
@@ -291,12 +334,28 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             response = c.get("/users")
-            html = response.get_data(as_text=True)
 
             self.assertEqual(response.status_code, 200)
-            self.assertIn(f"@{self.testuser.username}", html)
+            self.assertRegex(response.data, self.testuser_handle)
 
-    #test search for specific user
+    def test_search_user_by_term(self):
+        """Does search only show users matching the term, ignoring case?"""
+
+        with self.client as c:
+            response = c.get("/users?q=USER2")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertRegex(response.data, self.testuser2_handle)
+            self.assertNotRegex(response.data, self.testuser_handle)
+
+    def test_list_users_past_last_page(self):
+        """Does a page past the last page of users show no users?"""
+
+        with self.client as c:
+            response = c.get("/users?page=2")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"Sorry, no users found", response.data)
 
 ########################################### DELETE TESTS ####################################################
         
@@ -304,27 +363,43 @@ class UserViewTestCase(TestCase):
         """Can delete user?"""
 
         with self.client as c:
-            with c.session_transaction() as sess:
-                sess[CURR_USER_KEY] = self.testuser.id
+            self.login(c, self.testuser.id)
 
             response = c.post("/users/delete", follow_redirects=True)
-            html = response.get_data(as_text=True)
 
             self.assertEqual(response.status_code, 200)
-            self.assertIn("User successfully deleted", html)
-
             # checks user successfully deleted
-            self.assertEqual(User.query.count(), 1)
+            self.assertIsNone(db.session.get(User, self.testuser_id))
+            self.assertIn(b"User successfully deleted", response.data)
+
+    def test_delete_user_with_messages_and_likes(self):
+        """Can delete a user who has messages, including self-liked ones?"""
+
+        message = Message(text="my own warble", user_id=self.testuser.id)
+        db.session.add(message)
+        db.session.commit()
+        message_id = message.id
+
+        self.testuser.liked_messages.append(message)
+        self.testuser.following.append(self.testuser2)
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, self.testuser.id)
+
+            response = c.post("/users/delete")
+
+            self.assertEqual(response.status_code, 302)
+            self.assertIsNone(db.session.get(User, self.testuser_id))
+            self.assertIsNone(db.session.get(Message, message_id))
 
     def test_delete_user_not_logged_in(self):
         """Can not delete user when not logged in"""
 
         with self.client as c:
             response = c.post("/users/delete", follow_redirects=True)
-            html = response.get_data(as_text=True)
 
             self.assertEqual(response.status_code, 200)
-            self.assertIn("Access unauthorized", html)
-
             # checks user was not deleted
-            self.assertEqual(User.query.count(), 2)
\ No newline at end of file
+            self.assertIsNotNone(db.session.get(User, self.testuser_id))
+            self.assertIn(b"Access unauthorized", response.data)
\ No newline at end of file
@@ -0,0 +1,189 @@
+"""Shared setup and helpers for the test suite.
+
+Importing this module configures the app for testing, so test modules
+import app (and CURR_USER_KEY) from here rather than from app.
+"""
+
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+from unittest import TestCase
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import NullPool
+
+from models import db, bcrypt
+
+SAVEPOINT_STATEMENTS = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+schema_created = False
+
+
+def get_test_database_url():
+    """Return the test database URL.
+
+    Under pytest-xdist (`pytest -n 4`) each worker gets a database of its
+    own, e.g. warbler-test-gw0, so workers never see each other's rows.
+    """
+
+    url = "postgresql:///warbler-test"
+    worker = os.environ.get("PYTEST_XDIST_WORKER")
+
+    if worker:
+        url = f"{url}-{worker}"
+
+    return url
+
+
+# BEFORE we import our app, point it at the test database and have it
+# load config.TestingConfig. Test modules import app, CURR_USER_KEY from
+# here, so this runs once, before anything else imports app.
+
+os.environ['DATABASE_URL'] = get_test_database_url()
+os.environ['FLASK_ENV'] = "testing"
+
+from app import app, CURR_USER_KEY  # noqa: E402
+
+# Hash the fixture password ("password") once; bcrypt is deliberately
+# slow, so fixtures build users with this instead of User.signup()
+
+PASSWORD_HASH = bcrypt.generate_password_hash("password").decode('UTF-8')
+
+
+def create_database():
+    """Create the test database if it doesn't exist yet."""
+
+    name = db.engine.url.database
+    server = create_engine(db.engine.url.set(database="postgres"),
+                           isolation_level="AUTOCOMMIT",
+                           poolclass=NullPool)
+
+    with server.connect() as conn:
+        exists = conn.scalar(
+            text("SELECT 1 FROM pg_database WHERE datname = :name"),
+            {"name": name},
+        )
+        if not exists:
+            conn.execute(text(f'CREATE DATABASE "{name}"'))
+
+
+def ensure_schema():
+    """Create the database and any missing tables, once per test run."""
+
+    global schema_created
+
+    if not schema_created:
+        create_database()
+        db.create_all()
+        schema_created = True
+
+
+@lru_cache(maxsize=None)
+def login_cookie(user_id):
+    """Return a signed session cookie value for a logged in user."""
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({CURR_USER_KEY: user_id})
+
+
+class TransactionalTestCase(TestCase):
+    """TestCase that never leaves rows behind in the test database.
+
+    Each test class runs inside one transaction on a single connection
+    that db.session is bound to, and each test inside a SAVEPOINT within
+    it. Commits made by tests and views only release an inner SAVEPOINT,
+    so rolling back the test's SAVEPOINT in tearDown undoes everything
+    without DELETEing any rows.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Open the class-wide connection and transaction."""
+
+        super().setUpClass()
+
+        ensure_schema()
+
+        cls.connection = db.engine.connect()
+        cls.transaction = cls.connection.begin()
+
+        db.session.remove()
+        db.session.configure(bind=cls.connection, binds={})
+
+        # start from empty tables in one statement; like everything else
+        # in the class's transaction, this is undone by the rollback
+        tables = ", ".join(table.name for table in db.metadata.sorted_tables)
+        cls.connection.execute(text(f"TRUNCATE {tables}"))
+
+    @classmethod
+    def tearDownClass(cls):
+        """Roll back the class-wide transaction and unbind the session."""
+
+        db.session.remove()
+        db.session.configure(bind=None)
+
+        cls.transaction.rollback()
+        cls.connection.close()
+
+        super().tearDownClass()
+
+    def setUp(self):
+        """Open this test's SAVEPOINT and one for the session to use."""
+
+        self.savepoint = self.connection.begin_nested()
+        self.session_savepoint = self.connection.begin_nested()
+
+        event.listen(db.session, "after_transaction_end",
+                     self._restart_session_savepoint)
+
+    def tearDown(self):
+        """Roll back everything this test wrote."""
+
+        event.remove(db.session, "after_transaction_end",
+                     self._restart_session_savepoint)
+
+        db.session.remove()
+
+        if self.session_savepoint.is_active:
+            self.session_savepoint.rollback()
+        self.savepoint.rollback()
+
+    def login(self, client, user_id):
+        """Log `client` in as the user with `user_id`.
+
+        Sets a signed session cookie directly, which skips the request
+        context (and HMAC) a session_transaction() block costs.
+        """
+
+        client.set_cookie("localhost", app.session_cookie_name,
+                          login_cookie(user_id))
+
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        """Fail if more than `limit` SQL statements run in the block.
+
+        Guards views against N+1 query regressions. Yields the list of
+        statements run so far.
+        """
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            # the SAVEPOINTs this class wraps around each test don't count
+            if not statement.startswith(SAVEPOINT_STATEMENTS):
+                statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertLessEqual(len(statements), limit, "\n\n".join(statements))
+
+    def _restart_session_savepoint(self, session, transaction):
+        """Give the session a fresh SAVEPOINT once it ends the last one."""
+
+        if not self.session_savepoint.is_active:
+            self.session_savepoint = self.connection.begin_nested()
+